@@ -7,7 +7,6 @@ from langgraph.types import interrupt
 from pydantic import ValidationError
 from dataclasses import dataclass
 import logfire
-import asyncio
 import sys
 import os
 
@@ -24,14 +23,20 @@ from agents.flight_agent import flight_agent, FlightDeps
 from agents.hotel_agent import hotel_agent, HotelDeps
 from agents.activity_agent import activity_agent
 from agents.final_planner_agent import final_planner_agent
+from run import run
 
 logfire.configure(send_to_logfire='if-token-present')
 
+# Reducer for list channels. LangGraph hands the current channel value to checkpoints and
+# streamed state by reference, so build a new list instead of extending `left` in place.
+def extend_reducer(left: List[Any], right: List[Any]) -> List[Any]:
+    return [*left, *right]
+
 # Define the state for our graph
 class TravelState(TypedDict):
     # Chat messages and travel details
     user_input: str
-    messages: Annotated[List[bytes], lambda x, y: x + y]
+    messages: Annotated[List[bytes], extend_reducer]
     travel_details: Dict[str, Any]
 
     # User preferences
@@ -272,4 +277,4 @@ async def main():
 
 # Example usage
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    run(main())
\ No newline at end of file
@@ -7,13 +7,13 @@ from rich.text import Text
 from pydantic_ai import Agent
 from dotenv import load_dotenv
 from typing import List
-import asyncio
 import logfire
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from agents.info_gathering_agent import info_gathering_agent
+from run import run
 
 # Load environment variables
 load_dotenv()
@@ -49,4 +49,4 @@ async def main():
     await cli.chat()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run(main())
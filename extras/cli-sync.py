@@ -1,6 +1,5 @@
 from dotenv import load_dotenv
 from typing import List
-import asyncio
 import logfire
 import sys
 import os
@@ -9,6 +8,7 @@ from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, Text
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from agents.flight_agent import flight_agent, FlightDeps
+from run import run
 
 # Load environment variables
 load_dotenv()
@@ -65,4 +65,4 @@ async def main():
     await cli.chat()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run(main())
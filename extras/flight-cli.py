@@ -7,13 +7,13 @@ from rich.text import Text
 from pydantic_ai import Agent
 from dotenv import load_dotenv
 from typing import List
-import asyncio
 import logfire
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from agents.flight_agent import flight_agent, FlightDeps
+from run import run
 
 # Load environment variables
 load_dotenv()
@@ -63,4 +63,4 @@ async def main():
     await cli.chat()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run(main())
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+from typing import Any, Protocol
+
+from cachetools import LRUCache
+
+
+class CacheBackend(Protocol):
+    """Async key/value store used by `ZhipuModel` to cache deterministic responses."""
+
+    async def get(self, key: str) -> Any | None: ...
+
+    async def set(self, key: str, value: Any, ttl: int | None = None) -> None: ...
+
+
+class InMemoryLRUBackend:
+    """Process-local LRU cache, good enough for dev loops and test reruns."""
+
+    def __init__(self, maxsize: int = 500):
+        self._cache: LRUCache[str, tuple[float | None, Any]] = LRUCache(maxsize=maxsize)
+
+    async def get(self, key: str) -> Any | None:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            self._cache.pop(key, None)
+            return None
+        return value
+
+    async def set(self, key: str, value: Any, ttl: int | None = None) -> None:
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._cache[key] = (expires_at, value)
+
+
+class RedisBackend:
+    """Redis-backed cache shared across processes. Requires the optional `redis` package.
+
+    A redis asyncio connection pool only works on the event loop it was first used on, so one
+    client is created lazily per running loop (like `ZhipuModel._shared_http`) and clients for
+    closed loops are dropped.
+    """
+
+    def __init__(self, url: str = 'redis://localhost:6379/0', prefix: str = 'llm-cache:'):
+        try:
+            from redis import asyncio as aioredis
+        except ImportError as e:
+            raise ImportError('RedisBackend requires the `redis` package: pip install redis') from e
+        self._from_url = aioredis.from_url
+        self._url = url
+        self._prefix = prefix
+        self._clients: dict[asyncio.AbstractEventLoop, Any] = {}
+        self._lock = threading.Lock()
+
+    def _redis(self) -> Any:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for stale_loop in [other for other in self._clients if other.is_closed()]:
+                del self._clients[stale_loop]
+            client = self._clients.get(loop)
+            if client is None:
+                client = self._clients[loop] = self._from_url(self._url)
+        return client
+
+    async def get(self, key: str) -> Any | None:
+        raw = await self._redis().get(self._prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any, ttl: int | None = None) -> None:
+        await self._redis().set(self._prefix + key, json.dumps(value), ex=ttl)
@@ -0,0 +1,15 @@
+import asyncio
+from collections.abc import Coroutine
+from typing import Any
+
+
+def run(main: Coroutine[Any, Any, Any]) -> Any:
+    """Run `main` on uvloop (winloop on Windows) when installed, else the stdlib event loop."""
+    try:
+        import uvloop as fast_loop
+    except ImportError:
+        try:
+            import winloop as fast_loop
+        except ImportError:
+            return asyncio.run(main)
+    return fast_loop.run(main)
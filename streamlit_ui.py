@@ -3,12 +3,12 @@ from typing import List, Dict, Any
 from pydantic import BaseModel
 from datetime import datetime
 import streamlit as st
-import asyncio
 import uuid
 import json
 import os
 
 from agent_graph import travel_agent_graph
+from run import run
 
 
 # Page configuration
@@ -224,4 +224,4 @@ async def main():
     st.caption("Powered by Pydantic AI and LangGraph | Built with Streamlit")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run(main())
@@ -1,8 +1,8 @@
-import asyncio
 import os
 from pydantic import BaseModel, Field
 from pydantic_ai import Agent
 from zhipu_model import ZhipuModel
+from run import run
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -32,4 +32,4 @@ async def main():
         traceback.print_exc()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run(main())
@@ -1,6 +1,7 @@
 from pydantic_ai.models.openai import OpenAIModel
 from zhipu_model import ZhipuModel
 from dotenv import load_dotenv
+from functools import lru_cache
 import os
 
 load_dotenv()
@@ -10,7 +11,12 @@ def get_model():
     base_url = os.getenv('BASE_URL', 'https://api.openai.com/v1')
     api_key = os.getenv('LLM_API_KEY', 'no-api-key-provided')
     provider = os.getenv("PROVIDER", 'openai')
-    
+
+    return _build_model(provider, llm, base_url, api_key)
+
+# Memoized so every agent shares one model instance (and its HTTP connection pool)
+@lru_cache(maxsize=8)
+def _build_model(provider: str, llm: str, base_url: str, api_key: str):
     if provider == 'zhipu':
         return ZhipuModel(
             llm,
@@ -22,4 +28,4 @@ def get_model():
             llm,
             base_url=base_url,
             api_key=api_key
-        )
\ No newline at end of file
+        )
@@ -2,13 +2,16 @@ from __future__ import annotations
 
 import asyncio
 import json
+import random
+import threading
+from hashlib import sha256
 from collections.abc import Iterable, AsyncIterator
 from datetime import datetime, timezone
 from typing import Literal, Any, cast
-from functools import partial
 from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
 
+import httpx
 from pydantic_ai.messages import (
     ModelMessage,
     ModelRequest,
@@ -30,14 +33,77 @@ from pydantic_ai.models import (
 from pydantic_ai.settings import ModelSettings
 from pydantic_ai.tools import ToolDefinition
 from pydantic_ai.usage import Usage
-from zhipuai import ZhipuAI
-from zhipuai.types.chat.chat_completion import CompletionUsage
+
+from llm_cache import CacheBackend
+
+# Zhipu exposes an OpenAI-compatible REST API, so we talk to it directly over httpx
+# instead of going through the sync zhipuai SDK and a thread pool.
+DEFAULT_BASE_URL = 'https://open.bigmodel.cn/api/paas/v4'
+
+# How long a cached deterministic response stays valid, in seconds
+CACHE_TTL = 3600
+
+# Bounded retry with exponential backoff on rate limits, server errors and transport failures,
+# matching what the zhipuai SDK did for us before (3 retries, 0.5s doubling up to 8s)
+MAX_RETRIES = 3
+RETRY_INITIAL_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+_RETRY_STATUS_CODES = frozenset({408, 409, 429})  # plus any 5xx
+
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# orjson is several times faster than stdlib json on the message/tool payloads; fall back if it's missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def _dumpb(obj: Any, sort_keys: bool = False) -> bytes:
+        # OPT_NON_STR_KEYS accepts int/float/bool/None keys the way stdlib json does
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option)
+
+    _loads = orjson.loads
+else:
+    def _dumpb(obj: Any, sort_keys: bool = False) -> bytes:
+        return json.dumps(obj, sort_keys=sort_keys, separators=(',', ':'), ensure_ascii=False).encode()
+
+    _loads = json.loads
+
+
+def _dumps(obj: Any) -> str:
+    return _dumpb(obj).decode()
+
+
+def _retry_delay(attempt: int, retry_after: str | None = None) -> float:
+    # Honour a numeric Retry-After from the server, otherwise back off exponentially with jitter
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    return min(RETRY_INITIAL_DELAY * 2 ** attempt, RETRY_MAX_DELAY) * random.uniform(0.75, 1.0)
+
+
+async def _iter_sse_chunks(response: httpx.Response) -> AsyncIterator[dict[str, Any]]:
+    """Yield the decoded JSON payload of each `data:` line of a server-sent event stream."""
+    async for line in response.aiter_lines():
+        if not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            break
+        if data:
+            yield _loads(data)
 
 
 @dataclass
 class ZhipuStreamedResponse(StreamedResponse):
     _model_name: str
-    _response_iter: Any
+    _response_iter: AsyncIterator[dict[str, Any]]
     _timestamp: datetime
     _parts_manager: ModelResponsePartsManager = field(default_factory=ModelResponsePartsManager, init=False)
     _usage: Usage = field(default_factory=Usage, init=False)
@@ -51,68 +117,130 @@ class ZhipuStreamedResponse(StreamedResponse):
         return self._timestamp
 
     async def _get_event_iterator(self) -> AsyncIterator[ModelResponseStreamEvent]:
-        loop = asyncio.get_running_loop()
-        
-        _sentinel = object()
-        while True:
-            # Iterate the sync iterator in executor
-            chunk = await loop.run_in_executor(None, next, self._response_iter, _sentinel)
-            if chunk is _sentinel:
-                break
-
-            # Process chunk
-            if not chunk.choices:
-                # Verify usage in final chunk?
-                if chunk.usage:
-                     self._usage = Usage(
-                        request_tokens=chunk.usage.prompt_tokens,
-                        response_tokens=chunk.usage.completion_tokens,
-                        total_tokens=chunk.usage.total_tokens
-                     )
-                continue
-
-            choice = chunk.choices[0]
-            delta = choice.delta
-            
-            # content
-            if delta.content:
-                yield self._parts_manager.handle_text_delta(vendor_part_id='content', content=delta.content)
-            
-            # tool calls
-            if delta.tool_calls:
-                 for tc in delta.tool_calls:
-                    maybe_event = self._parts_manager.handle_tool_call_delta(
-                        vendor_part_id=tc.index,
-                        tool_name=tc.function.name,
-                        args=tc.function.arguments,
-                        tool_call_id=tc.id,
-                    )
-                    if maybe_event is not None:
-                        yield maybe_event
+        handle_text_delta = self._parts_manager.handle_text_delta
+        handle_tool_call_delta = self._parts_manager.handle_tool_call_delta
+
+        async for chunk in self._response_iter:
+            # Process chunk (the final chunk may carry only usage and no choices)
+            choices = chunk.get('choices')
+            if choices:
+                delta = choices[0].get('delta') or {}
+                
+                # content
+                if delta.get('content'):
+                    yield handle_text_delta(vendor_part_id='content', content=delta['content'])
+                
+                # tool calls
+                if delta.get('tool_calls'):
+                     for tc in delta['tool_calls']:
+                        function = tc.get('function') or {}
+                        maybe_event = handle_tool_call_delta(
+                            vendor_part_id=tc.get('index'),
+                            tool_name=function.get('name'),
+                            args=function.get('arguments'),
+                            tool_call_id=tc.get('id'),
+                        )
+                        if maybe_event is not None:
+                            yield maybe_event
             
-            # usage (sometimes in chunk with choices or separate)
-            if chunk.usage:
+            # usage (sometimes in chunk with choices or separate); only rebuild it when it changes
+            usage = chunk.get('usage')
+            if usage and usage['total_tokens'] != self._usage.total_tokens:
                  self._usage = Usage(
-                    request_tokens=chunk.usage.prompt_tokens,
-                    response_tokens=chunk.usage.completion_tokens,
-                    total_tokens=chunk.usage.total_tokens
+                    request_tokens=usage['prompt_tokens'],
+                    response_tokens=usage['completion_tokens'],
+                    total_tokens=usage['total_tokens']
                  )
 
 
+def _map_system_part(part: SystemPromptPart) -> dict[str, Any]:
+    return {'role': 'system', 'content': part.content}
+
+
+def _map_user_part(part: UserPromptPart) -> dict[str, Any]:
+    return {'role': 'user', 'content': part.content}
+
+
+def _map_tool_return_part(part: ToolReturnPart) -> dict[str, Any]:
+    # Tool return is a tool message
+    return {
+        'role': 'tool',
+        'tool_call_id': part.tool_call_id,
+        'content': part.content if isinstance(part.content, str) else _dumps(part.content)
+    }
+
+
+def _map_retry_part(part: RetryPromptPart) -> dict[str, Any] | None:
+    # Retry prompt is treated as user message
+    if part.content:
+        return {'role': 'user', 'content': part.content}
+    return None
+
+
+# Exact-type dispatch is cheaper than a chain of isinstance checks per part
+_REQUEST_PART_MAPPERS = {
+    SystemPromptPart: _map_system_part,
+    UserPromptPart: _map_user_part,
+    ToolReturnPart: _map_tool_return_part,
+    RetryPromptPart: _map_retry_part,
+}
+
+
 class ZhipuModel(Model):
+    # Shared connection pools keyed by running event loop, then base URL. An httpx.AsyncClient
+    # only works on the loop its connections were opened on, and callers like the Streamlit UI
+    # start a fresh loop per run, so pools for closed loops are dropped on the next lookup.
+    _http_clients: dict[asyncio.AbstractEventLoop, dict[str, httpx.AsyncClient]] = {}
+    # Streamlit runs each session's script in its own thread, so guard the shared registry
+    _http_clients_lock = threading.Lock()
+
     def __init__(
         self,
         model_name: str,
         *,
         api_key: str | None = None,
         base_url: str | None = None,
-        zhipu_client: ZhipuAI | None = None,
+        http_client: httpx.AsyncClient | None = None,
+        cache: CacheBackend | None = None,
     ):
         self._model_name = model_name
-        if zhipu_client:
-            self.client = zhipu_client
-        else:
-            self.client = ZhipuAI(api_key=api_key, base_url=base_url)
+        self._cache = cache
+        # Mapped tool schemas keyed by (name, description, id(parameters_json_schema)). pydantic-ai
+        # builds a fresh ToolDefinition every step but reuses the tool's schema dict, so that dict is
+        # the stable part; it is kept in the entry so its id can't be recycled while the entry lives.
+        self._tool_cache: dict[tuple[str, str | None, int], tuple[dict[str, Any], dict[str, Any]]] = {}
+        # Auth goes on each request so one pooled client can serve every model for a base URL
+        self._headers = dict(_JSON_HEADERS)
+        if api_key:
+            self._headers['Authorization'] = f'Bearer {api_key}'
+        # Models are built at import time, before any loop runs, so the shared client is
+        # looked up lazily per request; an explicitly passed client is used as-is.
+        self._base_url = base_url or DEFAULT_BASE_URL
+        self._http_client = http_client
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._http_client is not None:
+            return self._http_client
+        return self._shared_http(self._base_url)
+
+    @classmethod
+    def _shared_http(cls, base_url: str) -> httpx.AsyncClient:
+        """Return the client for `base_url` on the running event loop, creating it on first use."""
+        loop = asyncio.get_running_loop()
+        with cls._http_clients_lock:
+            for stale_loop in [other for other in cls._http_clients if other.is_closed()]:
+                del cls._http_clients[stale_loop]
+            clients = cls._http_clients.setdefault(loop, {})
+            client = clients.get(base_url)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(
+                    base_url=base_url,
+                    http2=True,
+                    limits=httpx.Limits(max_keepalive_connections=100, max_connections=200),
+                    timeout=httpx.Timeout(60, connect=5),
+                )
+                clients[base_url] = client
+        return client
 
     @property
     def model_name(self) -> str:
@@ -129,50 +257,25 @@ class ZhipuModel(Model):
         model_request_parameters: ModelRequestParameters | None = None,
     ) -> tuple[ModelResponse, Usage]:
         
-        # Prepare parameters
-        tools: list[dict[str, Any]] = []
-        if model_request_parameters and model_request_parameters.function_tools:
-            tools.extend(
-                self._map_tool_definition(t) 
-                for t in model_request_parameters.function_tools
-            )
-        
-        if model_request_parameters and model_request_parameters.result_tools:
-             tools.extend(
-                self._map_tool_definition(t) 
-                for t in model_request_parameters.result_tools
-            )
+        body = self._build_request_body(messages, model_settings, model_request_parameters)
 
-        # Map messages
-        glm_messages = self._map_messages(messages)
-
-        # Let's check model settings
-        kwargs = {}
-        if model_settings:
-            if model_settings.max_tokens is not None:
-                kwargs['max_tokens'] = model_settings.max_tokens
-            if model_settings.temperature is not None:
-                kwargs['temperature'] = model_settings.temperature
-            if model_settings.top_p is not None:
-                kwargs['top_p'] = model_settings.top_p
-
-        if tools:
-            kwargs['tools'] = tools
-            if model_request_parameters and not model_request_parameters.allow_text_result and model_request_parameters.result_tools:
-                 kwargs['tool_choice'] = 'auto'
+        # Only deterministic calls are safe to serve from the cache
+        cache_key = None
+        if self._cache is not None and body.get('temperature', 0) == 0:
+            cache_key = self._cache_key(body)
+            cached = await self._cache.get(cache_key)
+            if cached is not None:
+                return self._process_response(cached)
 
         # Make request
-        # We'll use the sync client in a non-blocking way
-        loop = asyncio.get_running_loop()
-        func = partial(
-            self.client.chat.completions.create,
-            model=self.model_name,
-            messages=glm_messages,
-            **kwargs
-        )
-        response = await loop.run_in_executor(None, func)
+        response = await self._send(body)
+        data = _loads(response.content)
+
+        # Tool calls have side effects downstream, so never replay them from the cache
+        if cache_key is not None and not any(c['message'].get('tool_calls') for c in data.get('choices') or []):
+            await self._cache.set(cache_key, data, ttl=CACHE_TTL)
         
-        return self._process_response(response)
+        return self._process_response(data)
 
     @asynccontextmanager
     async def request_stream(
@@ -182,76 +285,95 @@ class ZhipuModel(Model):
         model_request_parameters: ModelRequestParameters | None = None,
     ) -> AsyncIterator[StreamedResponse]:
         
-        # Prepare parameters
-        tools: list[dict[str, Any]] = []
-        if model_request_parameters and model_request_parameters.function_tools:
-            tools.extend(
-                self._map_tool_definition(t) 
-                for t in model_request_parameters.function_tools
-            )
-        
-        if model_request_parameters and model_request_parameters.result_tools:
-             tools.extend(
-                self._map_tool_definition(t) 
-                for t in model_request_parameters.result_tools
+        body = self._build_request_body(messages, model_settings, model_request_parameters, stream=True)
+        response = await self._send(body, stream=True)
+        try:
+            streamed_response = ZhipuStreamedResponse(
+                _model_name=self.model_name,
+                _response_iter=_iter_sse_chunks(response),
+                _timestamp=datetime.now(timezone.utc)
             )
+            
+            yield streamed_response
+        finally:
+            await response.aclose()
+
+    async def _send(self, body: dict[str, Any], stream: bool = False) -> httpx.Response:
+        """POST `body` to `/chat/completions`, retrying 429/5xx responses and transport errors.
 
-        glm_messages = self._map_messages(messages)
+        With `stream=True` the response body is left unread and the caller must close it. Only
+        opening the request is retried; a stream that fails midway is not replayed.
+        """
+        client = self._http()
+        request = client.build_request('POST', '/chat/completions', content=_dumpb(body), headers=self._headers)
+        for attempt in range(MAX_RETRIES + 1):
+            retry_after = None
+            try:
+                response = await client.send(request, stream=stream)
+            except httpx.TransportError:
+                if attempt == MAX_RETRIES:
+                    raise
+            else:
+                if not response.is_error:
+                    return response
+                if stream:
+                    await response.aread()
+                    await response.aclose()
+                retryable = response.status_code in _RETRY_STATUS_CODES or response.status_code >= 500
+                if attempt == MAX_RETRIES or not retryable:
+                    response.raise_for_status()
+                retry_after = response.headers.get('retry-after')
+            await asyncio.sleep(_retry_delay(attempt, retry_after))
+        raise AssertionError('unreachable')
+
+    def _build_request_body(
+        self,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters | None,
+        stream: bool = False,
+    ) -> dict[str, Any]:
+        """Build the `/chat/completions` JSON body shared by `request` and `request_stream`."""
+        body: dict[str, Any] = {'model': self._model_name, 'messages': self._map_messages(messages)}
 
-        kwargs = {}
         if model_settings:
-            if model_settings.max_tokens is not None:
-                kwargs['max_tokens'] = model_settings.max_tokens
-            if model_settings.temperature is not None:
-                kwargs['temperature'] = model_settings.temperature
-            if model_settings.top_p is not None:
-                kwargs['top_p'] = model_settings.top_p
+            for key in ('max_tokens', 'temperature', 'top_p'):
+                value = model_settings.get(key)
+                if value is not None:
+                    body[key] = value
 
+        tools = self._mapped_tools(model_request_parameters)
         if tools:
-            kwargs['tools'] = tools
+            body['tools'] = tools
             if model_request_parameters and not model_request_parameters.allow_text_result and model_request_parameters.result_tools:
-                 kwargs['tool_choice'] = 'auto'
-
-        kwargs['stream'] = True
+                body['tool_choice'] = 'auto'
 
-        loop = asyncio.get_running_loop()
-        func = partial(
-            self.client.chat.completions.create,
-            model=self.model_name,
-            messages=glm_messages,
-            **kwargs
-        )
-        # response_iter is the sync iterator from zhipuai
-        response_iter = await loop.run_in_executor(None, func)
-        
-        streamed_response = ZhipuStreamedResponse(
-            _model_name=self.model_name,
-            _response_iter=response_iter,
-            _timestamp=datetime.now(timezone.utc)
-        )
-        
-        yield streamed_response
+        if stream:
+            body['stream'] = True
+        return body
 
     def _map_messages(self, messages: list[ModelMessage]) -> list[dict[str, Any]]:
+        """Map pydantic-ai messages to GLM chat messages.
+
+        System prompts are hoisted to the front and every other part keeps its own message in
+        insertion order, so the request prefix is identical from turn to turn and server-side
+        prompt caching can hit. Callers should put all `SystemPromptPart`s up front and never
+        change tool definitions mid-conversation, otherwise the cached prefix is invalidated.
+        """
+        system_messages = []
         glm_messages = []
         for msg in messages:
             if isinstance(msg, ModelRequest):
                 for part in msg.parts:
-                    if isinstance(part, SystemPromptPart):
-                        glm_messages.append({'role': 'system', 'content': part.content})
-                    elif isinstance(part, UserPromptPart):
-                        glm_messages.append({'role': 'user', 'content': part.content})
-                    elif isinstance(part, ToolReturnPart):
-                        # Tool return is a tool message
-                        glm_messages.append({
-                            'role': 'tool',
-                            'tool_call_id': part.tool_call_id,
-                            'content': part.content if isinstance(part.content, str) else json.dumps(part.content)
-                        })
-                    elif isinstance(part, RetryPromptPart):
-                        # Retry prompt is treated as user message
-                        if part.content:
-                             glm_messages.append({'role': 'user', 'content': part.content})
+                    mapper = _REQUEST_PART_MAPPERS.get(type(part))
+                    if mapper is not None:
+                        mapped = mapper(part)
+                        if mapped is None:
+                            continue
+                        if mapper is _map_system_part:
+                            system_messages.append(mapped)
+                        else:
+                            glm_messages.append(mapped)
             elif isinstance(msg, ModelResponse):
                 # Assistant message
                 content = None
@@ -265,7 +387,8 @@ class ZhipuModel(Model):
                             'type': 'function',
                             'function': {
                                 'name': part.tool_name,
-                                'arguments': json.dumps(part.args) if isinstance(part.args, dict) else part.args
+                                # GLM returns arguments as a JSON string; pass it back untouched
+                                'arguments': part.args if isinstance(part.args, str) else _dumps(part.args)
                             }
                         })
                 
@@ -277,7 +400,28 @@ class ZhipuModel(Model):
                 
                 glm_messages.append(message_dict)
                 
-        return glm_messages
+        return system_messages + glm_messages
+
+    def _cache_key(self, body: dict[str, Any]) -> str:
+        # The body already holds model, messages, tools and sampling settings
+        return sha256(_dumpb(body, sort_keys=True)).hexdigest()
+
+    def _mapped_tools(self, params: ModelRequestParameters | None) -> list[dict[str, Any]]:
+        if params is None:
+            return []
+        tools = []
+        for tool in (*params.function_tools, *params.result_tools):
+            schema = tool.parameters_json_schema
+            key = (tool.name, tool.description, id(schema))
+            cached = self._tool_cache.get(key)
+            if cached is None or cached[0] is not schema:
+                # A `prepare` hook may return a new schema or description each step; keep the cache bounded
+                if len(self._tool_cache) >= 256:
+                    self._tool_cache.clear()
+                cached = (schema, self._map_tool_definition(tool))
+                self._tool_cache[key] = cached
+            tools.append(cached[1])
+        return tools
 
     def _map_tool_definition(self, tool: ToolDefinition) -> dict[str, Any]:
         description = tool.description
@@ -294,33 +438,38 @@ class ZhipuModel(Model):
             },
         }
 
-    def _process_response(self, response) -> tuple[ModelResponse, Usage]:
-        choices = response.choices
+    def _process_response(self, response: dict[str, Any]) -> tuple[ModelResponse, Usage]:
+        choices = response.get('choices')
         if not choices:
             # Handle empty choice or raise error
             # Some models return empty choice if only usage is present?
             pass
         
         choice = choices[0]
-        message = choice.message
+        message = choice['message']
         
         parts = []
-        if message.content:
-            parts.append(TextPart(content=message.content))
+        if message.get('content'):
+            parts.append(TextPart(content=message['content']))
         
-        if message.tool_calls:
-            for tc in message.tool_calls:
-                args = tc.function.arguments
+        if message.get('tool_calls'):
+            for tc in message['tool_calls']:
+                args = tc['function']['arguments']
                 parts.append(ToolCallPart(
-                    tool_name=tc.function.name,
-                    args=args, # pydantic-ai will parse integer/json string
-                    tool_call_id=tc.id
+                    tool_name=tc['function']['name'],
+                    args=args, # kept as the raw JSON string; pydantic-ai parses it lazily
+                    tool_call_id=tc['id']
                 ))
         
+        usage_data = response['usage']
         usage = Usage(
-            request_tokens=response.usage.prompt_tokens,
-            response_tokens=response.usage.completion_tokens,
-            total_tokens=response.usage.total_tokens
+            request_tokens=usage_data['prompt_tokens'],
+            response_tokens=usage_data['completion_tokens'],
+            total_tokens=usage_data['total_tokens']
         )
         
-        return ModelResponse(parts=parts, timestamp=datetime.now()), usage
+        # Prefer the server's `created` time over a local clock read
+        created = response.get('created')
+        timestamp = datetime.fromtimestamp(created, tz=timezone.utc) if created else datetime.now(timezone.utc)
+        
+        return ModelResponse(parts=parts, timestamp=timestamp), usage